@@ -23,7 +23,7 @@ import warnings
 from warnings import warn
 from textwrap import wrap
 
-from utility import listvalue, metadict
+from utility import listvalue, metadict, value
 from gpstime import leapseconds, gpstz, utctz, taitz, getgpstime
 
 TECUns = 2.854  # TECU/ns according to GPS-Scinda, Charles Carrano, 4-7-08
@@ -46,6 +46,73 @@ def showwarn(message, category, filename, lineno, file=sys.stderr, line=None):
 
 warnings.showwarning = showwarn
 
+LOSTLOCK_SHIFT = 0
+ANTISPOOFING_SHIFT = 2
+WAVE_SHIFT = 3
+STR_SHIFT = 5
+LOSTLOCK_MASK = 1 << LOSTLOCK_SHIFT
+ANTISPOOFING_MASK = 1 << ANTISPOOFING_SHIFT
+WAVE_MASK = 3 << WAVE_SHIFT
+STR_MASK = ~0 << STR_SHIFT
+"""Layout of ObsValue.flags: the loss of lock and antispoofing bits are where
+they are in the RINEX LLI; the wavelength factor (0-2) and signal strength (0-9)
+are shifted above them."""
+
+class ObsValue(float):
+    """An observation value, with the flags recorded along with it.
+
+    Attributes are lostlock, wavefactor, antispoofing, and strength.
+    There is one of these per observation, so they are packed into the single
+    integer slot `flags', and read through properties.  The properties raise
+    AttributeError if no flags were recorded.
+    """
+    __slots__ = ('flags',)
+
+    @staticmethod
+    def packflags(lli, wavefactor, strength):
+        """Pack a RINEX LLI, wavelength factor and signal strength into flags."""
+        return ((lli & (LOSTLOCK_MASK | ANTISPOOFING_MASK)) |
+                (wavefactor << WAVE_SHIFT) | (strength << STR_SHIFT))
+
+    def _getflag(self, mask, shift):
+        return (self.flags & mask) >> shift
+
+    def _setflag(self, mask, shift, val):
+        self.flags = (getattr(self, 'flags', 0) & ~mask) | ((int(val) << shift) & mask)
+
+    @property
+    def lostlock(self):
+        return bool(self._getflag(LOSTLOCK_MASK, LOSTLOCK_SHIFT))
+
+    @lostlock.setter
+    def lostlock(self, val):
+        self._setflag(LOSTLOCK_MASK, LOSTLOCK_SHIFT, bool(val))
+
+    @property
+    def antispoofing(self):
+        return bool(self._getflag(ANTISPOOFING_MASK, ANTISPOOFING_SHIFT))
+
+    @antispoofing.setter
+    def antispoofing(self, val):
+        self._setflag(ANTISPOOFING_MASK, ANTISPOOFING_SHIFT, bool(val))
+
+    @property
+    def wavefactor(self):
+        return self._getflag(WAVE_MASK, WAVE_SHIFT)
+
+    @wavefactor.setter
+    def wavefactor(self, val):
+        self._setflag(WAVE_MASK, WAVE_SHIFT, val)
+
+    @property
+    def strength(self):
+        return self._getflag(STR_MASK, STR_SHIFT)
+
+    @strength.setter
+    def strength(self, val):
+        self._setflag(STR_MASK, STR_SHIFT, val)
+
+
 class Record(dict):
     """A record of observations (many satellites, many channels) at a given epoch.
 
@@ -123,12 +190,15 @@ class Record(dict):
         if 'P2' not in self[prn]:
             bad += 1
         for val in self[prn].values():
+            if not hasattr(val, 'flags'):
+                continue
             if val.antispoofing:
                 bad += 1
             if val.wavefactor == 2:
                 bad += 1
-            if val.strength and val.strength < 4:
-                bad += 4 - val.strength
+            strength = val.strength
+            if strength and strength < 4:
+                bad += 4 - strength
         return bad
         # TODO: Check for 'S1', 'S2' in obs and compare to averages thereof
         # TODO: Get satellite position and increase bad for lower elevations
@@ -360,10 +430,12 @@ class SatData(list):
             self.tzinfo = taitz
         baseyear = None
         if 'firsttime' in self.meta:
-            self.meta.firsttime = self.meta.firsttime.replace(tzinfo=self.tzinfo)
+            old = self.meta.firsttime
+            self.meta.firsttime = value(old.replace(tzinfo=self.tzinfo), **vars(old))
             baseyear = self.meta.firsttime.year
         if 'endtime' in self.meta:
-            self.meta.endtime = self.meta.endtime.replace(tzinfo=self.tzinfo)
+            old = self.meta.endtime
+            self.meta.endtime = value(old.replace(tzinfo=self.tzinfo), **vars(old))
             if baseyear is None:
                 baseyear = self.meta.endtime.year
         return baseyear
@@ -535,7 +607,7 @@ class GPSData(SatData):
     def add(self, which, prn, obs, val):
         """Add observation value to the given record, while helping track phase-connected arcs."""
         super().add(which, prn, obs, val)
-        if val.lostlock:
+        if hasattr(val, 'flags') and val.lostlock:
             self.breakphase(prn)
 
     def endphase(self, prn):
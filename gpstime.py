@@ -24,8 +24,6 @@ NB: Standard Python datetime objects are only precise to 1 microsecond.
 import re
 import os
 from os import path
-from urllib.request import urlopen
-from urllib.error import URLError
 from datetime import datetime, timedelta, timezone, tzinfo as TZInfo
 import time
 from warnings import warn
@@ -166,6 +164,8 @@ class LeapSeconds(dict):
             return False
         if not os.access(path.dirname(cls.infofile), os.W_OK):
             raise IOError('Leap second data file cannot be written.')
+        from urllib.request import urlopen
+        from urllib.error import URLError
         try:
             upd = urlopen(URL1)
             form = 1
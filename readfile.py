@@ -15,13 +15,8 @@ import os
 import re
 import io
 import sys
-import gzip
 import time
-from urllib.request import urlretrieve
-import tarfile
-import pickle
-from optparse import OptionParser
-from utility import decompress
+from utility import decompress_stream, fileread
 
 from __init__ import __ver__
 import rinex
@@ -30,6 +25,10 @@ try:
 except ImportError:
     pass
 
+RINEX_NAME = re.compile(r'\.[0-9]{2}[Oo]$')
+CRINEX_NAME = re.compile(r'\.[0-9]{2}[Dd]$')
+"""Filename extensions of RINEX observation and Compact RINEX files."""
+
 def read_file(URL, format=None, verbose=False, gunzip=None, untar=None):
     """Process URL into a GPSData object.
 
@@ -37,11 +36,14 @@ def read_file(URL, format=None, verbose=False, gunzip=None, untar=None):
     tar archives.  Then simplistic extension-based format detection is used,
     unless the argument `format' is supplied.
     """
+    import tarfile
+    import gzip
     if os.path.isfile(os.path.expanduser(URL)):
         filename = os.path.expanduser(URL)
         if verbose:
             print('Local file', filename, 'used directly.')
     else:
+        from urllib.request import urlretrieve
         try:
             (filename, headers) = urlretrieve(URL)
         except ValueError:
@@ -66,8 +68,11 @@ def read_file(URL, format=None, verbose=False, gunzip=None, untar=None):
     elif gunzip == 2 or (gunzip is None and filename.endswith('.Z')):
         if verbose:
             print('Uncompressing file.')
-        filename = decompress(filename, True)
-        zfile = open(filename)
+        zfile = fileread(decompress_stream(filename))
+        if filename.endswith('.Z'):
+            zfile.name = filename[:-2]
+        else:
+            zfile.name = filename
     elif gunzip == 1 or (gunzip is None and filename.lower().endswith(('.gz', '.z'))):
         if verbose:
             print('Gunzipping file.')
@@ -79,11 +84,11 @@ def read_file(URL, format=None, verbose=False, gunzip=None, untar=None):
         else:
             zfile.name = filename
     else:
-        zfile = open(filename)
+        zfile = open(filename, 'rb')
     if format is None:
-        if re.search(r'\.[0-9]{2}[Oo]$', zfile.name):
+        if RINEX_NAME.search(zfile.name):
             format = 'RINEX'
-        elif re.search(r'\.[0-9]{2}[Dd]$', zfile.name):
+        elif CRINEX_NAME.search(zfile.name):
             format = 'CRINEX'
     if format in ('RINEX', 'CRINEX'):
         if verbose:
@@ -118,6 +123,8 @@ def index(req, n_file, n_type):
 
 def main():
     """Read GPS observation data, downloading, gunzipping, and uncompressing as necessary."""
+    import pickle
+    from optparse import OptionParser
     usage = sys.argv[0] + ' [-hvVgtGT] [-f FORMAT]'
     if 'plotter' in dir():
         usage = usage + ' [-i OBSERVATION]'
@@ -14,15 +14,17 @@ a GPSData object.
 # Support other RINEX file types (navigation message, meteorological data,
 # clock date file).
 
-import time
+from datetime import timedelta
 from itertools import zip_longest, repeat
 from copy import deepcopy
 from warnings import warn
 from collections import namedtuple
+from functools import lru_cache
+from operator import itemgetter
 
 from utility import fileread, listvalue, value
 from gpstime import gpsdatetime
-from gpsdata import GPSData
+from gpsdata import GPSData, ObsValue
 
 RNX_VER = '2.11'
 CR_VER = '1.0'
@@ -34,10 +36,22 @@ def btog(c):
         return 'G'
     return c.upper()
 
+class prnfield(dict):
+    """Map a raw 3-character satellite field, such as 'G05' or ' 5', to its PRN.
+
+    Each distinct field is only parsed once; afterward it is a dict lookup.
+    """
+    def __missing__(self, field):
+        prn = self[field] = btog(field[:1]) + '%02d' % toint(field[1:])
+        return prn
+
+PRN = prnfield()
+
+
 def toint(x):
-    if x is None or x.strip() == '':
+    if not x or x.isspace():
         return 0
-    return int(x)
+    return int(x)  # int() ignores surrounding whitespace itself
 
 def choose(a, b):
     if a is not None and b in (' ', None):
@@ -45,11 +59,46 @@ def choose(a, b):
     return b.replace('&', ' ')
 
 def tofloat(x):
-    if x is None or x.strip() == '':
+    if not x or x.isspace():
         return 0.
-    return float(x)
-
-to3float = lambda line : tuple(tofloat(line[k*14:(k+1)*14]) for k in (0, 1, 2))
+    try:
+        return float(x)
+    except ValueError:
+        # Some writers leave a bare decimal point for a zero value
+        if x.strip() == '.':
+            return 0.
+        raise
+
+def to3float(line, *, _cols=itemgetter(slice(0, 14), slice(14, 28), slice(28, 42))):
+    """Parse three consecutive F14.4 values (e.g. an XYZ position)."""
+    return tuple(map(tofloat, _cols(line)))
+
+FLAGDIGIT = {' ' : 0, '0' : 0, '1' : 1, '2' : 2, '3' : 3, '4' : 4, '5' : 5,
+             '6' : 6, '7' : 7, '8' : 8, '9' : 9}
+"""Value of a single-character LLI or signal strength field."""
+
+def _getter(items):
+    """Like itemgetter(*items), but always returning a tuple."""
+    if len(items) == 1:
+        return lambda seq, item=items[0]: (seq[item],)
+    if not items:
+        return lambda seq: ()
+    return itemgetter(*items)
+
+@lru_cache(maxsize=None)
+def epochfields(numobs, numsats):
+    """Return functions picking values, LLIs, and STRs out of an epoch's observations.
+
+    Each satellite's ceil(numobs/5) lines are padded to 80 columns and
+    concatenated into one block for the whole epoch.  Each observation takes
+    16 columns: a value (F14.3), LLI, and STR.  The padding after a satellite's
+    last observation is skipped.
+    """
+    width = -(-numobs // 5) * 80
+    starts = [sat * width + 16 * k for sat in range(numsats) for k in range(numobs)]
+    return (_getter([slice(s, s + 14) for s in starts]),
+            _getter([s + 14 for s in starts]),
+            _getter([s + 15 for s in starts]))
 
 def delta2float(x):
     return x.days * 86400. + float(x.seconds) + x.microseconds / 1e9
@@ -99,10 +148,13 @@ def fullyear(year, baseyear):
 
 def parseheadtime(line):
     """Parse RINEX time epoch, from headers, into gpsdatetime object."""
-# ignores last of the seven digits after decimal point in RINEX seconds
-    return gpsdatetime.strptime(line[:42], "  %Y    %m    %d    %H    %M   %S.%f")
-# strptime doesn't actually pay attention to the number of spaces in the format string,
-# but we specify the right number anyway...
+    # Fixed width fields: 5I6,F13.7
+    # ignores last of the seven digits after decimal point in RINEX seconds
+    sec, _, frac = line[30:42].partition('.')
+    frac = frac.rstrip()
+    usec = int(frac.ljust(6, '0')) if frac else 0
+    return gpsdatetime(int(line[0:6]), int(line[6:12]), int(line[12:18]),
+                       int(line[18:24]), int(line[24:30]), toint(sec), usec)
 
 
 def parsetime(line, baseyear):
@@ -112,10 +164,16 @@ def parsetime(line, baseyear):
     """
     if not line.strip():
         return None
+    # Fixed width fields: 1X,I2.2,4(1X,I2),F11.7
     year = fullyear(int(line[0:3]), baseyear)
-    mdhms = time.strptime(line[3:18], " %m %d %H %M %S")
+    sec = toint(line[15:18])
     usec = tofloat(line[18:26]) * 1000000
-    return gpsdatetime(year, *mdhms[1:6], usec, None)
+    if sec < 60:
+        return gpsdatetime(year, int(line[3:6]), int(line[6:9]), int(line[9:12]),
+                           int(line[12:15]), sec, usec, None)
+    # Some receivers write 60 seconds rather than rolling over the minute
+    return gpsdatetime(year, int(line[3:6]), int(line[6:9]), int(line[9:12]),
+                       int(line[12:15]), 0, usec, None) + timedelta(seconds=sec)
 
 
 def wavelength(line, *, waveinfo={'G%02d' % prn : (1, 1) for prn in range(1, 33)}):
@@ -140,7 +198,7 @@ def wavelength(line, *, waveinfo={'G%02d' % prn : (1, 1) for prn in range(1, 33)
         waveinfo.update(dict.fromkeys(waveinfo, (l1amb, l2amb)))
     else:
         for p in range(numsats):
-            prn = btog(line[21 + 6 * p]) + '%02d' % toint(line[22 + 6 * p : 24 + 6 * p])
+            prn = PRN[line[21 + 6 * p : 24 + 6 * p]]
             waveinfo[prn] = (l1amb, l2amb)
     return waveinfo.copy()
 
@@ -162,13 +220,11 @@ class obscode:
         if self.numtypes is not None and not nt:  # continuation line
             if len(self.obstypes) >= self.numtypes:
                 raise RuntimeError('Observation code headers seem broken.')
-            for ot in range(min(self.numtypes - len(self.obstypes), 9)):
-                self.obstypes += [line[6 * ot + 10 : 6 * ot + 12]]
+            self.obstypes.extend(line[6 * ot + 10 : 6 * ot + 12] for ot in
+                                 range(min(self.numtypes - len(self.obstypes), 9)))
         elif nt:
             self.numtypes = nt
-            self.obstypes = []
-            for ot in range(min(nt, 9)):
-                self.obstypes += [line[6 * ot + 10 : 6 * ot + 12]]
+            self.obstypes = [line[6 * ot + 10 : 6 * ot + 12] for ot in range(min(nt, 9))]
         else:
             raise RuntimeError('Observation type code continuation header '
                                'without beginning!')
@@ -198,7 +254,7 @@ def satnumobs():
         if prn.strip() == '' and oprn[0]:  # continuation line
             prn = oprn[0]
         elif prn.strip() != '':
-            prn = btog(prn[0]) + '%02d' % toint(prn[1:])
+            prn = PRN[prn]
             oprn[0] = prn
             if prn in sno:
                 warn('Repeated # OF OBS for PRN ' + prn + ', why?')
@@ -211,7 +267,7 @@ def satnumobs():
             if obs.strip() == '':
                 break
             else:
-                sno[prn] += [toint(obs)]
+                sno[prn].append(toint(obs))
         return sno
 
 
@@ -227,6 +283,8 @@ class header:
 
     def __init__(self, field_args, multi_act=0):
         self.mems = [header.field(*fargs) for fargs in field_args]
+        # Cut every field's columns out of a line in a single call
+        self._slice = _getter([slice(f.start, f.stop) for f in self.mems])
         self.seen = None
         self.multi_act = multi_act
         # multi_act: What to do when encountering this value again.
@@ -234,9 +292,10 @@ class header:
         # 1 : disallow
         # 2 : replace
 
-    @staticmethod
-    def _fread(field, line):
-        return value(field.convert(line[field.start:field.stop]))
+    def _fread(self, line):
+        """Return (name, value) pairs for each field in the given line."""
+        return [(field.name, value(field.convert(text)))
+                for field, text in zip(self.mems, self._slice(line))]
 
     def read(self, meta, line, recordnum, lineno, epoch=None):
         label = line[60:]
@@ -252,12 +311,12 @@ class header:
                 raise RuntimeError('Bad multiple-header action; fix RINEX')
         else:
             self.seen = recordnum
-        for field in self.mems:
-            meta[field.name] = self._fread(field, line)
-            meta[field.name].recordnum = recordnum
-            meta[field.name].lineno = lineno
+        for name, val in self._fread(line):
+            val.recordnum = recordnum
+            val.lineno = lineno
             if epoch is not None:
-                meta[field.name].epoch = epoch
+                val.epoch = epoch
+            meta[name] = val
 
 
 class listheader(header):
@@ -267,15 +326,12 @@ class listheader(header):
     They are accessed as a list.
     """
     def read(self, meta, line, recordnum, lineno, epoch=None):
-        for field in self.mems:
-            if field.name not in meta:
-                meta[field.name] = [self._fread(field,line)]
-            else:
-                meta[field.name] += [self._fread(field,line)]
-            meta[field.name][-1].recordnum = recordnum
-            meta[field.name][-1].lineno = lineno
+        for name, val in self._fread(line):
+            val.recordnum = recordnum
+            val.lineno = lineno
             if epoch is not None:
-                meta[field.name][-1].epoch = epoch
+                val.epoch = epoch
+            meta.setdefault(name, []).append(val)
 
 
 class listonce(header):
@@ -287,14 +343,14 @@ class listonce(header):
     record is returned.
     """
     def read(self, meta, line, recordnum, lineno, epoch=None):
-        for field in self.mems:
-            if field.name not in meta:
-                meta[field.name] = listvalue()
-            meta[field.name][recordnum] = self._fread(field,line)
-            meta[field.name][recordnum].recordnum = recordnum
-            meta[field.name][recordnum].lineno = lineno
+        for name, val in self._fread(line):
+            val.recordnum = recordnum
+            val.lineno = lineno
             if epoch is not None:
-                meta[field.name][recordnum].epoch = epoch
+                val.epoch = epoch
+            if name not in meta:
+                meta[name] = listvalue()
+            meta[name][recordnum] = val
 
 
 RINEX = {
@@ -339,15 +395,21 @@ RINEX = {
 #    'END OF HEADER       ' : header((), 1)
 }
 
+NORM_RINEX = {lbl.replace(' ', '') : lbl for lbl in RINEX}
+"""Map whitespace-stripped header labels to the correctly spaced label."""
+
 
 class recordLine:
     """Parse record headers (epoch lines) in standard RINEX.
 
     Combine continuation lines if necessary.
+    If `parse_flags' is false, the LLI and signal strength of observations
+    are not read.
     """
-    def __init__(self, baseyear):
+    def __init__(self, baseyear, parse_flags=True):
         self.line = ''
         self.baseyear = baseyear
+        self.parse_flags = parse_flags
         self.epoch = None
         self.intervals = set()
 
@@ -369,18 +431,43 @@ class recordLine:
 
         May consume extra lines if there are more than 12 PRNs.
         """
-        prnlist = []
+        prnlist = [None] * self.numrec
         line = self.line
         for z in range(self.numrec):
             s = z % 12
             if z and not s:
                 line = fid.next()
-            prn = btog(line[32 + s * 3]) + '%02d' % toint(line[33 + 3*s : 35 + 3*s])
-            prnlist += [prn]
+            prnlist[z] = PRN[line[32 + 3*s : 35 + 3*s]]
         return prnlist
 
-    def dataline(self, prn, numobs):
-        return obsLine()
+    def datalines(self, fid, numobs):
+        """Read the observations for every satellite in this epoch.
+
+        Return a list of (prn, dataline) pairs; iterating over a dataline
+        gives (value, LLI, STR) for each observation code.
+        All the satellites' lines are read and converted in one batch.
+        If the file ends partway through the epoch, only the observations
+        on the lines which were read are returned.
+        """
+        prns = self.prnlist(fid)
+        satlines = -(-numobs // 5)
+        numlines = len(prns) * satlines
+        lines = fid.read_batch(numlines)
+        block = ''.join([line[:80].ljust(80) for line in lines])
+        if len(lines) < numlines:
+            block = block.ljust(numlines * 80)
+        values, lli, strength = epochfields(numobs, len(prns))
+        obs = map(ObsValue, map(tofloat, values(block)))
+        if self.parse_flags:
+            obs = list(zip(obs, map(FLAGDIGIT.__getitem__, lli(block)),
+                           map(FLAGDIGIT.__getitem__, strength(block))))
+        else:
+            obs = list(zip(obs, repeat(0), repeat(0)))
+        datalines = [(prn, obs[i * numobs : (i + 1) * numobs]) for i, prn in enumerate(prns)]
+        if len(lines) < numlines:
+            for i, (prn, dataline) in enumerate(datalines):
+                del dataline[max(0, 5 * (len(lines) - i * satlines)):]
+        return datalines
 
     def offset(self, fid):
         """Return receiver clock offset optionally included at end of epoch line."""
@@ -392,10 +479,10 @@ class recordArc(recordLine):
 
     Each line only contains differences from the previous.
     """
-    def __init__(self, baseyear):
+    def __init__(self, baseyear, parse_flags=True):
         self.data = {}
         self.offsetval = None
-        recordLine.__init__(self, baseyear)
+        recordLine.__init__(self, baseyear, parse_flags)
 
     def getline(self, fid):
         self.offsetval = None
@@ -406,15 +493,24 @@ class recordArc(recordLine):
             return ''.join(choose(*ab) for ab in zip_longest(self.line, line))
 
     def prnlist(self, fid):
-        prnlist = []
-        for s in range(self.numrec):
-            prn = btog(self.line[32 + s * 3]) + '%02d' % \
-                                       toint(self.line[33 + s * 3 : 35 + s * 3])
-            prnlist += [prn]
-        return prnlist
+        line = self.line
+        return [PRN[line[32 + s * 3 : 35 + s * 3]] for s in range(self.numrec)]
 
     def dataline(self, prn, numobs):
-        return self.data.setdefault(prn, obsArcs(numobs))
+        if prn not in self.data:
+            self.data[prn] = obsArcs(numobs, self.parse_flags)
+        return self.data[prn]
+
+    def datalines(self, fid, numobs):
+        """Read the observations for every satellite in this epoch.
+
+        Return a list of (prn, dataline) pairs; iterating over a dataline
+        gives (value, LLI, STR) for each observation code.
+        """
+        datalines = [(prn, self.dataline(prn, numobs)) for prn in self.prnlist(fid)]
+        for prn, dataline in datalines:
+            dataline.update(fid)
+        return datalines
 
     def offset(self, fid):
         if self.offsetval is not None:
@@ -439,20 +535,26 @@ class dataArc:
     LLI and STR are kept separately at the end of the line in one character
     each.
     """
+    __slots__ = ('order', 'data', 'index')
+
     def __init__(self, order=3):
         self.order = order
         self.data = []
         self.index = 0
 
     def update(self, value):
+        data = self.data
         if self.index < self.order:
-            self.data.append(value)
+            data.append(value)
             self.index += 1
-        else:
-            self.data[self.order - 1] += value
-        for diff in range(self.index - 2, -1, -1):
-            self.data[diff] += self.data[diff + 1]
-        return self.data[0]
+            for diff in range(self.index - 2, -1, -1):
+                data[diff] += data[diff + 1]
+            return data[0]
+        # Once the arc is full, each difference is accumulated down the chain
+        # to reconstruct the value in one pass.
+        for diff in range(self.order - 1, -1, -1):
+            value = data[diff] = data[diff] + value
+        return value
 
     def get(self):
         if len(self.data):
@@ -466,6 +568,8 @@ class charArc:
     
     Only changes from the previous record are given; space indicates no change.
     """
+    __slots__ = ('data',)
+
     def __init__(self):
         self.data = '0'
     def update(self, char):
@@ -474,71 +578,64 @@ class charArc:
         return toint(self.data)
 
 
-class obsLine:
-    """Read observations out of line(s) in a record in a standard RINEX file."""
-    def update(self, fid):
-        self.fid = fid
-        self.ind = -1
-
-    def next(self):
-        self.ind = (self.ind + 1) % 5
-        if not self.ind:
-            self.line = self.fid.next()
-        val = value(tofloat(self.line[self.ind * 16 : self.ind * 16 + 14]))
-        LLI = toint(self.line[self.ind * 16 + 14 : self.ind * 16 + 15])
-        STR = toint(self.line[self.ind * 16 + 15 : self.ind * 16 + 16])
-        return (val, LLI, STR)
-
-    __next__ = next
-
-    def __iter__(self):
-        return self
-
-
 class obsArcs:
     """Calculate observations out of a line in a record in a compact RINEX file."""
-    def __init__(self, numobs):
+    def __init__(self, numobs, parse_flags=True):
         self.numobs = numobs
+        self.parse_flags = parse_flags
         self.arcs = [dataArc() for n in range(numobs)]
-        self.LLI = [charArc() for n in range(numobs)]
-        self.STR = [charArc() for n in range(numobs)]
+        if parse_flags:
+            self.LLI = [charArc() for n in range(numobs)]
+            self.STR = [charArc() for n in range(numobs)]
 
     def update(self, fid):
         line = fid.next()
+        # Fields are separated by single spaces; an empty field (no data)
+        # still takes its place, so a plain split keeps them aligned.
         vals = line.split(' ', self.numobs)
+        arcs = self.arcs
         for c, v in enumerate(vals[:self.numobs]):
-            if len(v) >= 2 and v[1] == '&':
-                self.arcs[c] = dataArc(toint(v[0]))
-                self.arcs[c].update(toint(v[2:]))
-            elif v.rstrip():
-                self.arcs[c].update(toint(v))
-            elif v.rstrip():
-                raise ValueError('Uninitialized data arc.')
-        if len(vals) > self.numobs:
+            if not v:
+                continue
+            elif v[1:2] == '&':
+                arcs[c] = dataArc(toint(v[0]))
+                arcs[c].update(toint(v[2:]))
+            else:
+                arcs[c].update(int(v))
+        if self.parse_flags and len(vals) > self.numobs:
             for c, l in enumerate(vals[self.numobs][0:self.numobs*2:2]):
                 self.LLI[c].update(l)
             for c, s in enumerate(vals[self.numobs][1:self.numobs*2:2]):
                 self.STR[c].update(s)
 
     def __getitem__(self, ind):
-        return (value(self.arcs[ind].get()/1000.), self.LLI[ind].get(),
+        if not self.parse_flags:
+            return (ObsValue(self.arcs[ind].get()/1000.), 0, 0)
+        return (ObsValue(self.arcs[ind].get()/1000.), self.LLI[ind].get(),
                 self.STR[ind].get())
 
 
-def get_data(fid, is_crx=None):
-    """Read data out of a RINEX 2.11 Observation Data File."""
+def get_data(fid, is_crx=None, parse_flags=True):
+    """Read data out of a RINEX 2.11 Observation Data File.
+
+    `fid' may be a file-like object or a filename, which may be gzipped.
+
+    If `parse_flags' is false, the loss of lock indicators and signal
+    strengths are skipped, and observation values get no `lostlock',
+    `wavefactor', `antispoofing' or `strength' attributes.
+    """
     obsdata = GPSData()
     obspersat = {}
     rinex = deepcopy(RINEX)  # avoid `seen' records polluting other instances
+    fid = fileread(fid)
     if hasattr(fid, 'name'):
         obsdata.meta['filename'] = fid.name
-    fid = fileread(fid)
     procheader(fid, rinex, obsdata.meta, 0)
     baseyear = obsdata.timesetup()
     if is_crx or 'is_crx' in obsdata.meta:
-        record = recordArc(baseyear)
+        record = recordArc(baseyear, parse_flags)
     else:
-        record = recordLine(baseyear)
+        record = recordLine(baseyear, parse_flags)
     while True:
         try:
             record.update(fid)
@@ -557,7 +654,7 @@ def get_data(fid, is_crx=None):
         #  What does that mean?
         if record.flag == 6:
             obsdata.breakphase(record.prnlist(fid))
-            [fid.next() for ll in range(record.numrec)]  # ignore records
+            fid.read_batch(record.numrec)  # ignore records
         elif record.flag == 5:
             procheader(fid, rinex, obsdata.meta, len(obsdata),
                        range(record.numrec), record.epoch)
@@ -570,28 +667,43 @@ def get_data(fid, is_crx=None):
                        range(record.numrec))
         elif 0 <= record.flag <= 1:
             obsdata.newrecord(record.epoch, powerfail=bool(record.flag), clockoffset=record.offset(fid))
-            for prn in record.prnlist(fid):
-                dataline = record.dataline(prn, len(obsdata.obscodes()))
+            obscodes = obsdata.obscodes()
+            if parse_flags:
+                if 'ambiguity' in obsdata.meta:
+                    ambiguity = obsdata.meta['ambiguity'][-1]
+                else:
+                    ambiguity = None
+                freqs = [toint(obs[1]) for obs in obscodes]
+            try:
+                datalines = record.datalines(fid, len(obscodes))
+            except StopIteration:
+                # The file ends partway through this epoch
+                break
+            for prn, dataline in datalines:
                 numobs = obspersat.setdefault(prn, {})
-                dataline.update(fid)
-                for obs, (val, LLI, STR) in zip(obsdata.obscodes(), dataline):
-                    val.lostlock = bool(LLI % 2)
-                    freq = toint(obs[1])
-                    if prn[0] != 'G' or freq > 2:
-                        val.wavefactor = 0
+                if not parse_flags:
+                    for obs, (val, LLI, STR) in zip(obscodes, dataline):
+                        obsdata.add(-1, prn, obs, val)
+                        numobs[obs] = numobs.get(obs, 0) + 1
+                    continue
+                isgps = prn[0] == 'G'
+                # L1/L2 ambiguities for this satellite, looked up at its
+                # first L1 or L2 observation
+                prnamb = None
+                for obs, freq, (val, LLI, STR) in zip(obscodes, freqs, dataline):
+                    if not isgps or freq > 2:
+                        wavefactor = 0
                     else:
-                        if 'ambiguity' not in obsdata.meta:
-                            ambig = 1
-                        else:
-                            ambig = obsdata.meta['ambiguity'][-1][prn][freq - 1]
+                        if prnamb is None:
+                            prnamb = (1, 1) if ambiguity is None else ambiguity[prn]
+                        ambig = prnamb[freq - 1]
                         if (LLI >> 1) % 2:
                             # wavelength factor opposite of currently set.
                             # By RINEX definition, valid only for GPS L1, L2
-                            val.wavefactor = (ambig % 2) + 1
+                            wavefactor = (ambig % 2) + 1
                         else:
-                            val.wavefactor = ambig
-                    val.antispoofing = bool((LLI >> 2) % 2)
-                    val.strength = STR
+                            wavefactor = ambig
+                    val.flags = ObsValue.packflags(LLI, wavefactor, STR)
                     obsdata.add(-1, prn, obs, val)
                     numobs[obs] = numobs.get(obs, 0) + 1
             obsdata.checkbreak()
@@ -608,17 +720,18 @@ def procheader(fid, RINEX, meta, recordnum, numlines=repeat(0), epoch=None):
             line = fid.next().ljust(80)  # pad spaces to 80
         except StopIteration:
             break
-        label = line[60:]
+        label = line[60:80]
         if label == 'END OF HEADER       ':
             break
-        elif label not in RINEX:
-            for lbl in RINEX:
-                if label.replace(' ', '') == lbl.replace(' ', ''):
-                    warn('Label ' + label + ' recognized as ' + lbl
-                         + ' despite incorrect whitespace.')
-                    label = lbl
-                    break
-        if label in RINEX:
-            RINEX[label].read(meta, line, recordnum, fid.lineno, epoch)
-        else:
-            warn('Header line ' + label + ' unrecognized; ignoring')
+        hdr = RINEX.get(label)
+        if hdr is None:
+            # Also catch labels shifted past column 80
+            label = line[60:]
+            lbl = NORM_RINEX.get(label.replace(' ', ''))
+            if lbl is None:
+                warn('Header line ' + label + ' unrecognized; ignoring')
+                continue
+            warn('Label ' + label + ' recognized as ' + lbl
+                 + ' despite incorrect whitespace.')
+            hdr = RINEX[lbl]
+        hdr.read(meta, line, recordnum, fid.lineno, epoch)
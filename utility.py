@@ -3,8 +3,13 @@
 These are not very specific in usage, however, and could be useful anywhere.
 """
 from contextlib import suppress, redirect_stdout, contextmanager
-import subprocess
+import shutil
+import io
 import os
+import threading
+import types
+import logging
+from bisect import bisect_left, bisect_right
 
 @contextmanager
 def stdouttofile(file):
@@ -12,13 +17,49 @@ def stdouttofile(file):
     with open(file, 'a') as f, redirect_stdout(f):
         yield
 
+log = logging.getLogger(__name__)
+
+try:
+    import ncompress
+except ImportError:
+    ncompress = None
+
+DECOMPRESSORS = [cmd for cmd in (['compress', '-d'], ['uncompress'],
+                                 ['gunzip'], ['gzip', '-d'])
+                 if shutil.which(cmd[0])]
+"""External commands (which are installed) able to decompress .Z files."""
+
+def _envrate(name, default):
+    """Return the rate (in MB/s) given in environment variable `name'.
+
+    The default is used if it is unset, or not a positive finite number.
+    """
+    try:
+        rate = float(os.environ[name])
+    except KeyError:
+        return default
+    except ValueError:
+        rate = 0
+    if not 0 < rate < float('inf'):
+        log.warning("Ignoring %s=%r; using %s", name, os.environ[name], default)
+        return default
+    return rate
+
+IO_BANDWIDTH = _envrate('GPSDATA_IO_BW_MBPS', 2000)
+DECOMPRESS_RATE = _envrate('GPSDATA_DECOMPRESS_MBPS', 250)
+"""Disk bandwidth, and the rate one decompression uses, in MB/s."""
+_io_sem = threading.BoundedSemaphore(max(1, int(IO_BANDWIDTH // DECOMPRESS_RATE)))
+# Bounds how many decompressions run at once, when called from several threads
+
 def decompress(filename, move=False):
     """Decompress a (Lempel-Ziv) compress'd file.
 
-    There seems to be no Python module to do this (the gzip module won't handle it,
-    though the gzip program will), so we call an external process.
+    The gzip module won't handle these, so unless the optional `ncompress'
+    module is installed, we call an external process (though the gzip program
+    will do.)
     These programs will only decompress if the filename ends with .Z;
     they remove the original file and output a file without the .Z.
+    If the decompressed file already exists, and is newer, it is used as is.
     """
 # However, given the -c flag, these programs will decompress to stdout, even if the filename
 #  does not end with .Z.
@@ -31,39 +72,175 @@ def decompress(filename, move=False):
             raise ValueError('Given filename ' + filename + ' does not end with .Z.')
     else:
         defile = filename[:-2]
-    decompresscmds = [['compress', '-d', filename],
-                      ['uncompress', filename],
-                      ['gunzip', filename],
-                      ['gzip', '-d', filename]]
-    for cmd in decompresscmds:
+    if (os.path.isfile(defile) and
+            os.path.getmtime(defile) >= os.path.getmtime(filename)):
+        # Already decompressed, and up to date
+        return defile
+    import subprocess
+    import tempfile
+    if ncompress is not None:
+        # Decompress to a temporary file, so a failure can't leave a partial
+        # file which would later be taken as up to date
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(defile) or '.')
+        try:
+            with _io_sem, open(filename, 'rb') as zfile, open(fd, 'wb') as outfile:
+                ncompress.decompress(zfile, outfile)
+            shutil.copymode(filename, tmpfile)
+            os.replace(tmpfile, defile)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmpfile)
+            raise
+        os.remove(filename)
+        return defile
+    for cmd in DECOMPRESSORS:
+        cmd = cmd + [filename]
         try:
-            subprocess.run(cmd, check=True)
+            with _io_sem:
+                subprocess.run(cmd, check=True)
         except (OSError, subprocess.CalledProcessError):
-            print("Command '", ' '.join(cmd), "' failed. Trying another...")
+            log.debug("Command '%s' failed. Trying another...", ' '.join(cmd))
             continue
         if os.path.isfile(defile):
             return defile
         else:
-            print("Command '", ' '.join(cmd), "' succeeded, but did not produce the output file?!")
+            log.warning("Command '%s' succeeded, but did not produce the output file?!",
+                        ' '.join(cmd))
+    raise RuntimeError('Could not get an external program to decompress the file ' + filename)
+
+class piperead(object):
+    """A binary file object reading the output of a running command.
+
+    When the output is used up, the command is waited for, and RuntimeError
+    is raised if it failed.  Closing early stops the command.
+    If a semaphore `sem' is given, it is released once the command is done.
+    Reading past the end keeps returning b'', as for any file:
+
+    >>> import subprocess
+    >>> cmd = ['echo', 'hi']
+    >>> f = piperead(subprocess.Popen(cmd, stdout=subprocess.PIPE), cmd)
+    >>> f.read(), f.read(), f.readline(), f.read(10)
+    (b'hi\\n', b'', b'', b'')
+    """
+    def __init__(self, proc, cmd, sem=None):
+        self.proc = proc
+        self.cmd = cmd
+        self.sem = sem
+        self.done = False
+
+    def _release(self):
+        if self.sem is not None:
+            self.sem.release()
+            self.sem = None
+
+    def _finish(self):
+        self.done = True
+        self.proc.stdout.close()
+        status = self.proc.wait()
+        self._release()
+        if status:
+            raise RuntimeError("Command '" + ' '.join(self.cmd) +
+                               "' failed with status " + str(status))
+
+    def read(self, size=-1):
+        if self.done:
+            return b''
+        data = self.proc.stdout.read(size)
+        if not data and size:
+            self._finish()
+        return data
+
+    def readline(self):
+        if self.done:
+            return b''
+        line = self.proc.stdout.readline()
+        if not line:
+            self._finish()
+        return line
+
+    def close(self):
+        if self.done:
+            return
+        if self.proc.poll() is None:
+            # Still running; we don't want the rest of its output
+            self.done = True
+            self.proc.stdout.close()
+            self.proc.terminate()
+            self.proc.wait()
+            self._release()
+        else:
+            self._finish()
+
+    def __del__(self):
+        # Dropped without being closed, e.g. when parsing fails partway
+        with suppress(Exception):
+            self.close()
+
+def decompress_stream(filename):
+    """Return a binary file object reading the decompressed contents of `filename'.
+
+    Like decompress(), but nothing is written to disk, and the compressed
+    file is left alone.  The decompressor's output is read through a pipe;
+    RuntimeError is raised at the end of it if the decompressor failed.
+    """
+    import subprocess
+    if ncompress is not None:
+        with _io_sem, open(filename, 'rb') as zfile:
+            return io.BytesIO(ncompress.decompress(zfile))
+    # The slot is held until the returned pipe is used up or closed
+    _io_sem.acquire()
+    try:
+        for cmd in DECOMPRESSORS:
+            cmd = cmd + ['-c', filename]
+            try:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, bufsize=1 << 20)
+            except OSError:
+                continue
+            # Wait for the first output, or for the command to fail
+            if proc.stdout.peek(1) or proc.wait() == 0:
+                return piperead(proc, cmd, _io_sem)
+            proc.stdout.close()
+            log.debug("Command '%s' failed. Trying another...", ' '.join(cmd))
+    except BaseException:
+        _io_sem.release()
+        raise
+    _io_sem.release()
     raise RuntimeError('Could not get an external program to decompress the file ' + filename)
 
 typedict = {}
 # Declaring classes is really slow, so we reuse them.
 
+def valuetype(base):
+    """Return the subclass of `base' used by value(), creating it if needed.
+
+    The subclass is named valued_<base>, and is also stored in this module,
+    so that its instances can be pickled.
+    """
+    try:
+        return typedict[base]
+    except KeyError:
+        pass
+    cls = types.new_class('valued_' + base.__name__, (base,))
+    cls.__module__ = __name__
+    globals()[cls.__name__] = cls
+    typedict[base] = cls
+    return cls
+
+for _base in (str, int, float, tuple, list, dict):
+    valuetype(_base)
+
 def value(thing, **kwargs):
     """Ensure that arbitrary attributes can be set on `thing'.
 
     E.g. foo = value(foo); foo.bar = 'qux'
     """
-    if hasattr(thing, '__dict__'):
-        pass
-    elif type(thing) in typedict:
-        thing = typedict[type(thing)](thing)
-    else:
-        class thething(type(thing)):
-            pass
-        typedict[type(thing)] = thething
-        thing = thething(thing)
+    cls = typedict.get(type(thing))
+    if cls is not None:
+        # A type we already know has no __dict__
+        thing = cls(thing)
+    elif not hasattr(thing, '__dict__'):
+        thing = valuetype(type(thing))(thing)
     thing.__dict__.update(kwargs)
     return thing
 
@@ -77,14 +254,86 @@ class listvalue(dict):
     for a range of records, but may be replaced.
     For convenience, listvalue[0] always returns the first definition
     and listvalue[-1] always returns the last.
+    The keys are also kept in a sorted list, so that lookups can bisect.
+    Records are usually looked up in order, so the range of keys covered by
+    the last value found is remembered, and checked first.
     """
+    _cache = _nocache = (1, 0, None)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._keys = sorted(dict.keys(self))
+
+    def __setitem__(self, key, val):
+        # When unpickled or copied, items may be set before (or after) _keys
+        # is restored, without __init__ being called.
+        keys = self.__dict__.setdefault('_keys', [])
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            keys.insert(i, key)
+        dict.__setitem__(self, key, val)
+        self._cache = self._nocache
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._keys.remove(key)
+        self._cache = self._nocache
+
+    def __copy__(self):
+        return type(self)(self)
+
+    def update(self, *args, **kwargs):
+        for key, val in dict(*args, **kwargs).items():
+            self[key] = val
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        if not dict.__contains__(self, key):
+            return dict.pop(self, key, *default)
+        val = dict.pop(self, key)
+        self._keys.remove(key)
+        self._cache = self._nocache
+        return val
+
+    def popitem(self):
+        key, val = dict.popitem(self)
+        self._keys.remove(key)
+        self._cache = self._nocache
+        return key, val
+
+    def clear(self):
+        dict.clear(self)
+        self._keys = []
+        self._cache = self._nocache
+
     def __getitem__(self, index):
+        keys = self._keys
+        if not keys:
+            raise KeyError(index)
         if index == 0:
-            index = min(self)
+            index = keys[0]
         elif index == -1:
-            index = max(self)
+            index = keys[-1]
         else:
-            index = max(k for k in self if k <= index)
+            lo, hi, val = self._cache
+            if lo <= index < hi:
+                return val
+            i = bisect_right(keys, index)
+            if not i:
+                raise KeyError(index)
+            val = dict.__getitem__(self, keys[i - 1])
+            hi = keys[i] if i < len(keys) else float('inf')
+            self._cache = (keys[i - 1], hi, val)
+            return val
         return dict.__getitem__(self, index)
 
     def __contains__(self, index):
@@ -98,15 +347,29 @@ class metadict(dict):
 
     Add a `numblocks' property (for the number of discontiguous header blocks)
     and field access for meta['name'] by meta.name.
+    numblocks is kept in a slot; assigning to any other attribute sets
+    that field.
     """
+    __slots__ = ('numblocks',)
+
     def __init__(self, *args, **kwargs):
         self.numblocks = 0
         dict.__init__(self, *args, **kwargs)
 
+    def __setattr__(self, name, val):
+        if name == 'numblocks':
+            object.__setattr__(self, name, val)
+        else:
+            self[name] = val
+
     def __getattr__(self, name):
-        if not name in self:
-            raise AttributeError()
-        return self[name]
+        if name[:2] == '__':
+            # Special names looked up by copy, pickle, etc. are never fields
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
 
 class fileread(object):
@@ -115,22 +378,39 @@ class fileread(object):
     Wrap "sufficiently file-like objects" (ie those with readline())
     in an iterable which counts line numbers, strips newlines, and raises
     StopIteration at EOF.
+    When the file supports read(), it is read in chunks of `bufsize'
+    characters, which are split into lines all at once.
+    Binary files are decoded as latin-1, a chunk at a time.
     """
+    __slots__ = ('fid', 'name', 'lineno', '_lines', '_pos', '_tail',
+                 '_partial', '_seekable', '_close_kind')
+    bufsize = 1 << 20
+
     def __new__(cls, file):
         """Create a fileread object.
 
         Input can be filename string, file descriptor number, or any object
-        with `readline'.
+        with `readline'.  Filenames ending with .gz are gunzipped as they
+        are read.  Files we open are opened in binary mode, and decoded as
+        latin-1 (which maps each byte straight to a character) in bulk.
         """
         if isinstance(file, fileread):
             file.reset()
             return file
         fr = object.__new__(cls)
-        if isinstance(file, str):
-            fr.fid = open(file)
+        fr._lines = []
+        fr._pos = 0
+        fr._tail = ''
+        fr._partial = False
+        if isinstance(file, str) and file.lower().endswith('.gz'):
+            import gzip
+            fr.fid = gzip.open(file)
+            fr.name = file
+        elif isinstance(file, str):
+            fr.fid = open(file, 'rb', buffering=cls.bufsize)
             fr.name = file
         elif isinstance(file, int):
-            fr.fid = os.fdopen(file)
+            fr.fid = os.fdopen(file, 'rb', buffering=cls.bufsize)
             fr.name = "FD: " + str(file)
         elif hasattr(file, 'readline'):
             fr.fid = file
@@ -141,6 +421,24 @@ class fileread(object):
         else:
             raise ValueError("Input of type " + str(type(file)) +
                              " is not supported.")
+        try:
+            fr._seekable = fr.fid.seekable()
+        except AttributeError:
+            fr._seekable = hasattr(fr.fid, 'seek')
+        except (OSError, ValueError):
+            fr._seekable = False
+        # Name of the method which closes the file, if it should be closed
+        if hasattr(fr.fid, 'close'):
+            fr._close_kind = 'close'
+        elif hasattr(fr.fid, 'quit'):
+            fr._close_kind = 'quit'
+        else:
+            fr._close_kind = None
+        with suppress(AttributeError, OSError, ValueError):
+            # Some file objects (e.g. in tar archives) have no usable fileno
+            if fr.fid.fileno() < 3:
+                # Closing stdin, stdout, stderr can be bad
+                fr._close_kind = None
         fr.reset()
         return fr
 
@@ -150,43 +448,107 @@ class fileread(object):
     def __exit__(self, *args):
         self.close()
 
+    def _fill(self):
+        """Read the next batch of lines from the file, with newlines stripped.
+
+        `_partial' is set if the last of them had no newline (end of file).
+        Return whether any lines were read.
+        """
+        self._pos = 0
+        if not hasattr(self.fid, 'read'):
+            line = self.fid.readline()
+            if isinstance(line, bytes):
+                line = line.decode('latin-1')
+            self._lines = [line.rstrip('\r\n')] if line else []
+            self._partial = not line.endswith(('\r', '\n'))
+            return bool(line)
+        lines = []
+        while not lines:
+            chunk = self.fid.read(self.bufsize)
+            if not chunk:
+                tail = self._tail
+                self._partial = not tail.endswith('\r')
+                self._lines = [tail.rstrip('\r')] if tail else []
+                self._tail = ''
+                return bool(tail)
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode('latin-1')
+            chunk = self._tail + chunk
+            if '\r' in chunk:
+                if chunk.endswith('\r'):
+                    # May be split from its '\n'; defer to the next chunk
+                    chunk, self._tail = chunk[:-1], '\r'
+                else:
+                    self._tail = ''
+                chunk = chunk.replace('\r\n', '\n').replace('\r', '\n')
+                lines = chunk.split('\n')
+                self._tail = lines.pop() + self._tail
+            else:
+                lines = chunk.split('\n')
+                self._tail = lines.pop()
+        self._lines = lines
+        self._partial = False
+        return True
+
     def next(self):
         """Return the next line, also incrementing `lineno'."""
-        line = self.fid.readline()
-        if not line:
-            raise StopIteration()
+        pos = self._pos
+        try:
+            line = self._lines[pos]
+        except IndexError:
+            # Only when the current batch is used up
+            if not self._fill():
+                raise StopIteration() from None
+            pos = 0
+            line = self._lines[0]
+        self._pos = pos + 1
         self.lineno += 1
-        return line.rstrip('\r\n')
+        return line
 
     __next__ = next
 
+    def read_batch(self, n):
+        """Return a list of the next `n' lines, also incrementing `lineno'.
+
+        Fewer lines are returned at the end of the file.
+        """
+        lines = self._lines[self._pos : self._pos + n]
+        self._pos += len(lines)
+        while len(lines) < n and self._fill():
+            more = self._lines[:n - len(lines)]
+            self._pos = len(more)
+            lines += more
+        self.lineno += len(lines)
+        return lines
+
     def readline(self):
         """A synonym for next() which doesn't strip newlines or raise StopIteration."""
-        line = self.fid.readline()
-        if line:
-            self.lineno += 1
-        return line
+        if self._pos >= len(self._lines) and not self._fill():
+            return ''
+        line = self._lines[self._pos]
+        self._pos += 1
+        self.lineno += 1
+        if self._partial and self._pos == len(self._lines):
+            return line
+        return line + '\n'
 
     def __iter__(self):
         return self
 
     def reset(self):
         """Go back to the beginning if possible. Set lineno to 0 regardless."""
-        if hasattr(self.fid, 'seek'):
+        if self._seekable:
             with suppress(OSError):
                 self.fid.seek(0)
+                self._lines = []
+                self._pos = 0
+                self._tail = ''
         self.lineno = 0
 
     def close(self):
         """Close the file.  A closed file cannot be used for further I/O."""
-        if hasattr(self.fid, 'fileno') and self.fid.fileno() < 3:
-            # Closing stdin, stdout, stderr can be bad
-            return
-        if hasattr(self.fid, 'close'):
-            with suppress(OSError, EOFError):
-                self.fid.close()
-        elif hasattr(self.fid, 'quit'):
+        if self._close_kind is not None:
             with suppress(OSError, EOFError):
-                self.fid.quit()
+                getattr(self.fid, self._close_kind)()
 
 